@@ -38,19 +38,31 @@ def _construct(identifier, payload):
 def _send(socket, message):
     print()
     print('sending', message)
-    print('in hex', ' '.join(['{:x}'.format(ch) for ch in message]))
+    print('in hex', message.hex(' '))
     socket.sendall(message)
 
 
-with socket(AF_INET, SOCK_STREAM) as s:
+def _receive(f):
+    """Reads a whole message, or returns an empty byte string on EOF."""
+    header = f.read(7)
+    if len(header) < 7:
+        return b''
+    payload_size = int.from_bytes(header[5:7], byteorder='big')
+    return header + f.read(payload_size + 2)
+
+
+with socket(AF_INET, SOCK_STREAM) as s, s.makefile('rb') as f:
     s.connect(('127.0.0.1', 1200))
 
     while True:
         # Receive message
-        message = s.recv(4096)
+        message = _receive(f)
+        if not message:
+            print('connection closed')
+            break
         print()
         print('received', message)
-        print('in hex', ' '.join(['{:x}'.format(ch) for ch in message]))
+        print('in hex', message.hex(' '))
         identifier = message[2:5]
         if identifier == b'\x01\x03\x02':
             _send(s, _construct(b'\x01\x83\x00', inverter['model']))
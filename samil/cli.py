@@ -1,19 +1,18 @@
 """Command-line interface."""
 import json
 import logging
-from collections import namedtuple
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from decimal import Decimal
-from time import time, sleep
+from functools import lru_cache
+from time import monotonic, time, sleep
 
 import click
-from influxdb_client import InfluxDBClient
-from influxdb_client.client.write_api import SYNCHRONOUS
-from paho.mqtt.client import Client as MQTTClient
 
-from samil.influx import status_to_point
 from samil.inverter import InverterNotFoundError, InverterFinder, KeepAliveInverter
 from samil.inverterutil import connect_inverters
-from samil.pvoutput import add_status, aggregate_statuses
+from samil.pvoutput import add_status, add_status_with_backlog, aggregate_statuses
 
 logger = logging.getLogger(__name__)
 
@@ -79,10 +78,21 @@ def monitor(interval: float, interface: str):
         'heatsink_temperature': ('Heatsink temperature', '°C'),
     }
 
-    def _format_two_tuple(t):
-        width = max([len(k) for k, v in t])
-        rows = ['{:.<{width}}...{}'.format(k, v, width=width) for k, v in t]
-        return '\n'.join(rows)
+    @lru_cache(maxsize=None)
+    def _row_format(width):
+        # Format string with the width filled in, e.g. '{:.<14}...{}'
+        return '{{:.<{}}}...{{}}'.format(width)
+
+    def _format_two_tuple(t, width=None):
+        if width is None:
+            width = max([len(k) for k, v in t])
+        row = _row_format(width)
+        return '\n'.join([row.format(k, v) for k, v in t])
+
+    @lru_cache(maxsize=None)
+    def _status_width(keys):
+        # The status keys of an inverter don't change, so the width is only computed once
+        return max(len(_status_keys[k][0]) for k in keys)
 
     def _format_model(d):
         t = [(_model_keys[k], v) for k, v in d.items()]
@@ -91,7 +101,7 @@ def monitor(interval: float, interface: str):
     def _format_status(d):
         t = [(_status_keys[k], v) for k, v in d.items()]
         t = [(form[0], '{}{}{}'.format(v, ' ' if form[1] else '', form[1])) for form, v in t]
-        return _format_two_tuple(t)
+        return _format_two_tuple(t, width=_status_width(tuple(d)))
 
     with InverterFinder(interface_ip=interface or '') as finder:
         print("Searching for inverter")
@@ -108,7 +118,7 @@ def monitor(interval: float, interface: str):
         print("Model info")
         print(_format_model(model_dict))
         n = 1
-        t = time()
+        t = monotonic()
         while True:
             status_dict = inverter.status()
             print()
@@ -116,7 +126,7 @@ def monitor(interval: float, interface: str):
             print(_format_status(status_dict))
             t += interval
             n += 1
-            sleep(max(t - time(), 0))
+            sleep(max(t - monotonic(), 0))
 
 
 class DecimalEncoder(json.JSONEncoder):
@@ -159,6 +169,9 @@ def mqtt(n: int, interval: float, host, port, client_id, tls: bool, username, pa
         "grid_voltage":242.6,"grid_current":3.6,"grid_frequency":50.01,
         "internal_temperature":35.0}
     """
+    # Imported here so that the other commands don't need to load the MQTT client
+    from paho.mqtt.client import Client as MQTTClient
+
     MQTTInverter = namedtuple("MQTTInverter", ["inverter", "topic", "serial_number"])
 
     print("Connecting to {} inverter(s)".format(n))
@@ -186,7 +199,7 @@ def mqtt(n: int, interval: float, host, port, client_id, tls: bool, username, pa
             print("Startup complete, now publishing status data every {} seconds to topic(s): {}".format(interval,
                                                                                                          topics))
 
-            start_time = time()
+            start_time = monotonic()
             while True:
                 for mqtt_inverter in mqtt_inverters:
                     status = mqtt_inverter.inverter.status()
@@ -197,7 +210,7 @@ def mqtt(n: int, interval: float, host, port, client_id, tls: bool, username, pa
 
                 # This doesn't suffer from drifting, however it will skip messages when
                 #  a message takes longer than the interval.
-                sleep(interval - ((time() - start_time) % interval))
+                sleep(interval - ((monotonic() - start_time) % interval))
         finally:
             # Disconnect MQTT on exception
             client.disconnect()
@@ -236,38 +249,53 @@ def pvoutput(system_id, api_key, interface, n: int, dc_voltage: bool, interval:
     make the application upload status data on the specified interval.
     This mode is not recommended. The application will stay connected to the
     inverters in between uploads and will crash when the connection is lost,
-    thus you need a restart mechanism such as systemd.
+    thus you need a restart mechanism such as systemd. When PVOutput.org
+    can't be reached, the status is uploaded together with the next one.
     """
     # Print info messages (at least)
     if logging.root.level > logging.INFO:
         logging.basicConfig(level=logging.INFO)
 
     logger.info("Connecting to inverter(s)")
-    with connect_inverters(interface, n) as inverters:
-        def upload():
-            """Uploads status to PVOutput."""
-            # Todo: this should be asynchronous so that multiple inverters can be requested at once
-            status_data = aggregate_statuses([inv.status() for inv in inverters], dc_voltage=dc_voltage)
+    # Statuses that could not be uploaded because of a network error, at most 30 fit in a batch upload
+    backlog = deque(maxlen=30)
+
+    with connect_inverters(interface, n) as inverters, ThreadPoolExecutor(len(inverters)) as executor:
+        def upload(date: datetime):
+            """Uploads status to PVOutput with the given date."""
+            # Request all inverters at once, each inverter has its own connection
+            statuses = list(executor.map(lambda inv: inv.status(), inverters))
+            status_data = aggregate_statuses(statuses, dc_voltage=dc_voltage)
             if not status_data:
                 logger.info("Not uploading, no inverter has operating mode normal")
                 return
+            status_data['date'] = date
 
             # Upload
             logger.info("Uploading status data: %s", status_data)
-            if not dry_run:
+            if dry_run:
+                return
+            if interval:
+                add_status_with_backlog(system_id, api_key, status_data, backlog)
+            else:
                 add_status(system_id, api_key, **status_data)
 
         if not interval:
             # No interval specified, upload once and stop
-            upload()
+            upload(datetime.now())
             return
 
         # Interval given, run periodically
         logger.info("Waiting for next interval boundary to do the first upload")
+        period = interval * 60
         while True:
-            # Sleep until next boundary
-            sleep(interval * 60 - time() % (interval * 60))
-            upload()
+            # Sleep until next boundary, the wall clock might have been adjusted
+            # while sleeping so check that the boundary has actually passed
+            boundary = (time() // period + 1) * period
+            while time() < boundary:
+                sleep(max(boundary - time(), 0))
+            # Use the boundary as status time, requesting the inverters might take a while
+            upload(datetime.fromtimestamp(boundary))
 
 
 #     # History
@@ -319,6 +347,11 @@ def influx(bucket: str, c: str, interval: float, interface: str, gzip: bool, mea
 
     Status is not written when the inverter is powered off at night.
     """
+    # Imported here so that the other commands don't need to load the InfluxDB client
+    from influxdb_client import InfluxDBClient
+    from influxdb_client.client.write_api import SYNCHRONOUS
+    from samil.influx import status_to_point
+
     # Print info messages (at least)
     if logging.root.level > logging.INFO:
         logging.basicConfig(level=logging.INFO)
@@ -335,11 +368,11 @@ def influx(bucket: str, c: str, interval: float, interface: str, gzip: bool, mea
 
         logger.info("Startup complete, will write every %s seconds to bucket %s with measurement name %s",
                     interval, bucket, measurement)
-        start = time()
+        start = monotonic()
         while True:
             p = status_to_point(measurement, inv.status())
             logger.debug("Writing point: %s", p)
             if p:
                 write_client.write(bucket=bucket, record=p)
             # Sleep until the next interval boundary
-            sleep(interval - (time() - start) % interval)
+            sleep(interval - (monotonic() - start) % interval)
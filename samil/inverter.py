@@ -2,16 +2,27 @@
 
 import logging
 import socket
+import struct
 import sys
 from collections import OrderedDict
-from threading import Event, Thread
-from time import sleep
-from typing import Tuple, Dict, BinaryIO, Any
+from functools import lru_cache
+from threading import Event, RLock, Thread
+from time import monotonic, sleep
+from typing import Tuple, Dict, BinaryIO, Any, Callable, List
 
-from samil.statustypes import status_types
+from samil.statustypes import decode_status
 
 logger = logging.getLogger(__name__)
 
+# Big-endian unsigned 16-bit integer, used for the payload size and checksum
+_U16 = struct.Struct('>H')
+
+# Message header: start (55 aa), identifier and payload size
+_HEADER = struct.Struct('>2s3sH')
+
+# Upper bound for the payload size of received messages, used as sanity check
+_MAX_PAYLOAD_SIZE = 4096
+
 
 class Inverter:
     """Provides methods for communicating with a connected inverter.
@@ -28,6 +39,17 @@ class Inverter:
     # Caches the format for inverter status messages
     _status_format = None
 
+    # Model signature (manufacturer, firmware version, model name), set by model()
+    _model_key = None
+
+    # Whether the status format was taken from the shared format cache
+    _status_format_shared = False
+
+    # Status formats shared between instances, keyed on the model signature.
+    #  Inverters of the same model return identical formats, so this saves a
+    #  request for each inverter after the first.
+    _format_cache: Dict[Tuple[str, str, str], bytes] = {}
+
     def __init__(self, sock: socket, addr):
         """Constructor.
 
@@ -36,8 +58,13 @@ class Inverter:
             addr: The inverter network address (currently not used).
         """
         self.sock = sock
-        self.sock_file = sock.makefile('rwb')
         self.addr = addr
+        # Reusable receive buffer, large enough for the largest payload plus checksum
+        self._recv_buffer = memoryview(bytearray(_MAX_PAYLOAD_SIZE + 2))
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Each message waits for a response, don't let Nagle's algorithm
+            #  delay sending it
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         # Inverters should respond in around 1.5 seconds, setting a timeout
         #  above that value will ensure that the application won't hang too
         #  long when the inverter doesn't send anything.
@@ -68,7 +95,6 @@ class Inverter:
             # * [WinError 10038] An operation was attempted on something that is not a socket
             if e.errno != 107 and e.errno != 9 and e.errno != 10038:
                 raise e
-        self.sock_file.close()
         self.sock.close()
 
     def model(self) -> Dict:
@@ -85,7 +111,7 @@ class Inverter:
             '5': 'S-phase inverter of the three combined single-phase ones',
             '6': 'T-phase inverter of the three combined single-phase ones',
         }
-        return OrderedDict(
+        model = OrderedDict(
             device_type=device_types[decode_string(payload[0:1])],
             va_rating=decode_string(payload[1:7]),
             firmware_version=decode_string(payload[7:12]),
@@ -96,6 +122,8 @@ class Inverter:
             other_version=decode_string(payload[65:70]),
             general=decode_string(payload[70:71]),
         )
+        self._model_key = (model['manufacturer'], model['firmware_version'], model['model_name'])
+        return model
 
     def status(self) -> Dict:
         """Gets current status data from the inverter.
@@ -105,23 +133,29 @@ class Inverter:
         For all possible values, see statustypes.py.
         """
         if not self._status_format:
-            # Retrieve and cache status format
-            self._status_format = self.status_format()
+            # Use the format of an inverter with the same model if we have it,
+            #  else retrieve it and cache it for the other inverters
+            self._status_format = self._format_cache.get(self._model_key)
+            self._status_format_shared = bool(self._status_format)
+            if not self._status_format:
+                self._status_format = self.status_format()
+                if self._model_key:
+                    self._format_cache[self._model_key] = self._status_format
 
         ident, payload = self.request(b'\x01\x02\x02', b'', b'\x01\x82')
 
         # Payload should be twice the size of the status format
+        if 2 * len(self._status_format) != len(payload) and self._status_format_shared:
+            # The format of the other inverter does not fit, drop it and use our own
+            self._format_cache.pop(self._model_key, None)
+            self._status_format = self.status_format()
+            self._status_format_shared = False
         if 2 * len(self._status_format) != len(payload):
             logger.warning("Size of status payload and format differs, format %s, payload %s",
                            self._status_format.hex(), payload.hex())
 
         # Retrieve all status data type values
-        status_values = OrderedDict()
-        for name, type_def in status_types.items():
-            val = type_def.get_value(self._status_format, payload)
-            if val is not None:
-                status_values[name] = val
-        return status_values
+        return decode_status(self._status_format, payload)
 
     def status_format(self):
         """Gets the format used for the status data messages from the inverter.
@@ -161,20 +195,43 @@ class Inverter:
 
         Raises:
             BrokenPipeError: When the connection is closed.
-            ValueError: When the connection was already closed, with a message
-                'write to closed file'.
+            OSError: When the socket was already closed, with errno 9 (bad
+                file descriptor).
         """
-        message = construct_message(identifier, payload)
-        logger.debug('Sending %s', message.hex())
-        self.sock_file.write(message)
-        self.sock_file.flush()
+        if payload:
+            message = construct_message(identifier, payload)
+        else:
+            message = _construct_empty_message(identifier)
+        self._send_raw(message)
+
+    def _send_raw(self, message: bytes):
+        """Sends an already constructed message, see send."""
+        if logger.isEnabledFor(logging.DEBUG):
+            # Only convert to hex when the message is actually logged
+            logger.debug('Sending %s', message.hex())
+        self.sock.sendall(message)
 
     def receive(self) -> Tuple[bytes, bytes]:
         """Reads and returns the next message from the inverter.
 
         See read_message.
         """
-        return read_message(self.sock_file)
+        return _read_message(self._recv_exact)
+
+    def _recv_exact(self, n: int) -> bytes:
+        """Receives exactly n bytes, or fewer when the connection is closed.
+
+        The bytes are received into a reusable buffer to prevent allocations
+        for partial reads.
+        """
+        view = self._recv_buffer[:n]
+        pos = 0
+        while pos < n:
+            count = self.sock.recv_into(view[pos:])
+            if not count:
+                break
+            pos += count
+        return bytes(view[:pos])
 
 
 class InverterFinder:
@@ -282,50 +339,105 @@ class InverterFinder:
             InverterNotFoundError: When no inverter was found after all search
                 messages have been sent.
         """
-        message = construct_message(b'\x00\x40\x02', b'I AM SERVER')
-        self.listen_sock.settimeout(interval)
-        # Broadcast socket
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as bc:
-            bc.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            bc.bind((self.interface_ip, 0))
-
-            for i in range(advertisements):
-                logger.debug('Sending server broadcast message')
-                bc.sendto(message, ('<broadcast>', 1300))
-                try:
-                    sock, addr = self.listen_sock.accept()
-                    logger.info('Connected with inverter on address %s', addr)
-                    # Wait before sending identification request
-                    sleep(1.0)
-                    return sock, addr
-                except socket.timeout:
-                    pass
-        raise InverterNotFoundError
+        return self.find_inverters(1, advertisements=advertisements, interval=interval)[0]
+
+    def find_inverters(self, n: int, advertisements=10, interval=5.0) -> List[Tuple[socket.socket, Any]]:
+        """Searches for multiple inverters on the network.
+
+        All inverters that connect after an advertisement are accepted, so
+        multiple inverters can be found with a single advertisement.
+
+        Args:
+            n: Number of inverters to search for.
+            interval: Time between each search message/advertisement.
+            advertisements: Number of advertisement messages to send.
+
+        Returns:
+            A list of n (socket, address) tuples, see find_inverter.
+
+        Raises:
+            InverterNotFoundError: When fewer than n inverters were found after
+                all search messages have been sent. The connections with the
+                inverters that were found are closed.
+        """
+        found = []
+        try:
+            # Broadcast socket
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as bc:
+                bc.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                bc.bind((self.interface_ip, 0))
+
+                for i in range(advertisements):
+                    logger.debug('Sending server broadcast message')
+                    bc.sendto(_ADVERTISEMENT_MESSAGE, ('<broadcast>', 1300))
+                    # Accept connections until the next advertisement is due
+                    deadline = monotonic() + interval
+                    while len(found) < n:
+                        timeout = deadline - monotonic()
+                        if timeout <= 0:
+                            break
+                        self.listen_sock.settimeout(timeout)
+                        try:
+                            sock, addr = self.listen_sock.accept()
+                        except socket.timeout:
+                            break
+                        logger.info('Connected with inverter on address %s', addr)
+                        found.append((sock, addr))
+                    if len(found) >= n:
+                        # Wait before sending identification request
+                        sleep(1.0)
+                        return found
+            raise InverterNotFoundError
+        except BaseException:
+            for sock, addr in found:
+                sock.close()
+            raise
 
 
 def decode_string(val: bytes) -> str:
     """Decodes a possibly null terminated byte sequence to a string using ASCII and strips whitespace."""
+    return _decode_string_cached(bytes(val))
+
+
+@lru_cache(maxsize=256)
+def _decode_string_cached(val: bytes) -> str:
+    """See decode_string.
+
+    Results are cached, because the model information of an inverter does not
+    change.
+    """
     return val.partition(b'\x00')[0].decode('ascii').strip()
 
 
 def calculate_checksum(message: bytes) -> bytes:
     """Calculates the checksum for a message.
 
-    The message should not have a checksum appended to it.
+    The message should not have a checksum appended to it. The checksum is
+    the sum of all bytes, truncated to 16 bits.
 
     Returns:
         The checksum, as a byte sequence of length 2.
     """
-    return sum(message).to_bytes(2, byteorder='big')
+    return _U16.pack(sum(message) & 0xffff)
 
 
 def construct_message(identifier: bytes, payload: bytes) -> bytes:
     """Constructs an inverter message from identifier and payload."""
-    start = b'\x55\xaa'
-    payload_size = len(payload).to_bytes(2, byteorder='big')
-    message = start + identifier + payload_size + payload
-    checksum = calculate_checksum(message)
-    return message + checksum
+    header = _HEADER.pack(b'\x55\xaa', identifier, len(payload))
+    checksum = _U16.pack((sum(header) + sum(payload)) & 0xffff)
+    return b''.join((header, payload, checksum))
+
+
+@lru_cache(maxsize=16)
+def _construct_empty_message(identifier: bytes) -> bytes:
+    """Constructs a message without payload.
+
+    Almost all requests have no payload, so these messages are cached.
+    """
+    return construct_message(identifier, b'')
+
+
+_ADVERTISEMENT_MESSAGE = construct_message(b'\x00\x40\x02', b'I AM SERVER')
 
 
 def read_message(stream: BinaryIO) -> Tuple[bytes, bytes]:
@@ -339,28 +451,37 @@ def read_message(stream: BinaryIO) -> Tuple[bytes, bytes]:
         ValueError: When the message has an incorrect format, e.g. checksum is
             invalid or the first two bytes are not '55 aa'.
     """
-    # Message start + check for EOF
-    start = stream.read(2)
-    if start == b"":
+    return _read_message(stream.read)
+
+
+def _read_message(read: Callable[[int], bytes]) -> Tuple[bytes, bytes]:
+    """Reads the next inverter message using the given read function.
+
+    The read function is called with a number of bytes and should return
+    exactly that many bytes, or fewer when EOF is encountered. See
+    read_message for return value and exceptions.
+    """
+    # Message start, identifier and payload size + check for EOF
+    header = read(_HEADER.size)
+    if header == b"":
         raise InverterEOFError
-    if start != b"\x55\xaa":
+    if header[0:2] != b"\x55\xaa":
         raise ValueError("Invalid start of message")
+    if len(header) != _HEADER.size:
+        raise InverterEOFError
+    _, identifier, payload_size = _HEADER.unpack(header)
 
-    # Identifier
-    identifier = stream.read(3)
-
-    # Payload
-    payload_size_bytes = stream.read(2)
-    payload_size = int.from_bytes(payload_size_bytes, byteorder='big')
-    if payload_size < 0 or payload_size > 4096:  # Sanity check for strange payload size values
+    # Payload and checksum
+    if payload_size > _MAX_PAYLOAD_SIZE:  # Sanity check for strange payload size values
         raise ValueError("Unexpected payload size value")
-    payload = stream.read(payload_size)
-
-    # Checksum
-    checksum = stream.read(2)
-    message = start + identifier + payload_size_bytes + payload
-    if checksum != calculate_checksum(message):
-        raise ValueError('Checksum invalid for message %s', message.hex())
+    body = read(payload_size + 2)
+    if len(body) != payload_size + 2:
+        raise InverterEOFError
+    payload = body[:payload_size]
+    # Sum header and payload separately to not concatenate them
+    checksum, = _U16.unpack_from(body, payload_size)
+    if checksum != (sum(header) + sum(payload)) & 0xffff:
+        raise ValueError('Checksum invalid for message %s', (header + payload).hex())
 
     return identifier, payload
 
@@ -401,6 +522,8 @@ class KeepAliveInverter(Inverter):
         self.keep_alive_period = keep_alive
         self.keep_alive_timer = None
 
+        self._last_message = monotonic()  # Time of the last message sent or received
+        self._lock = RLock()  # Prevents keep-alive messages during other requests
         self._ka_thread = None  # Keep-alive thread
         self._ka_stop = Event()  # Used for stopping keep-alive messages
         self.start_keep_alive()
@@ -425,34 +548,56 @@ class KeepAliveInverter(Inverter):
         self._ka_thread.start()
 
     def _ka_runner(self):
-        """Sends a keep-alive periodically until stopped."""
+        """Sends a keep-alive when the last message is too long ago, until stopped.
+
+        The thread lives as long as keep-alive is enabled, requests only move
+        the deadline forward.
+        """
         while True:
+            timeout = self._last_message + self.keep_alive_period - monotonic()
             # stopped will be False when the timeout occurred
-            stopped = self._ka_stop.wait(timeout=self.keep_alive_period)
+            stopped = self._ka_stop.wait(timeout=max(timeout, 0.0))
             if stopped:
                 return
-            self.keep_alive()
+            with self._lock:
+                # Another message might have been sent in the meantime
+                if monotonic() - self._last_message >= self.keep_alive_period:
+                    try:
+                        self.keep_alive()
+                    except Exception as e:
+                        # Keep the thread running, the next request or keep-alive
+                        #  will tell whether the connection is actually lost
+                        logger.warning("Keep-alive failed: %r", e)
+                        self._last_message = monotonic()
 
     def keep_alive(self):
         """Sends a keep-alive message."""
         # We have to call the superclass because self.send/self.receive
         #  interfere with the keep-alive runner.
-        super().send(b"\x01\x02\x02", b"")  # Status message
+        super()._send_raw(_construct_empty_message(b"\x01\x02\x02"))  # Status message
         # super().send(b"\x01\x09\x02", b"")  # Unknown message
         super().receive()
+        self._last_message = monotonic()
+
+    def request(self, identifier: bytes, payload: bytes, expected_response_id=b"") -> Tuple[bytes, bytes]:
+        """See base class."""
+        # Hold the lock for the whole request so that a keep-alive can't
+        #  intercept the response
+        with self._lock:
+            return super().request(identifier, payload, expected_response_id)
 
     def send(self, identifier: bytes, payload: bytes):
         """See base class."""
-        self.stop_keep_alive()
-        super().send(identifier, payload)
-        self.start_keep_alive()
+        with self._lock:
+            super().send(identifier, payload)
+            self._last_message = monotonic()
 
     def receive(self) -> Tuple[bytes, bytes]:
         """See base class."""
-        self.stop_keep_alive()
-        msg = super().receive()
-        self.start_keep_alive()
-        return msg
+        with self._lock:
+            msg = super().receive()
+            self._last_message = monotonic()
+            return msg
 
     def disconnect(self):
         """See base class."""
@@ -12,7 +12,7 @@ def connect_inverters(interface: str = '', n: int = 1):
     of the with statement.
     """
     with InverterFinder(interface_ip=interface) as finder:
-        inverters = [KeepAliveInverter(*finder.find_inverter()) for i in range(n)]
+        inverters = [KeepAliveInverter(*conn) for conn in finder.find_inverters(n)]
 
     try:
         yield inverters
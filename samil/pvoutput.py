@@ -1,7 +1,8 @@
 """PVOutput.org methods."""
 import logging
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Deque, List, Dict, Optional, Tuple
+from urllib.error import HTTPError
 from urllib.parse import urlencode
 from urllib.request import Request, urlopen
 
@@ -29,9 +30,10 @@ def add_status(system, api_key, date: datetime = None, energy_gen=None, power_ge
     """
     if not date:
         date = datetime.now()
+    d, t = _format_date(date)
     data = {
-        'd': date.strftime('%Y%m%d'),
-        't': date.strftime('%H:%M'),
+        'd': d,
+        't': t,
         'v1': energy_gen,
         'v2': power_gen,
         'v3': energy_con,
@@ -45,12 +47,86 @@ def add_status(system, api_key, date: datetime = None, energy_gen=None, power_ge
     if net:
         data['n'] = '1'
 
+    return _post('http://pvoutput.org/service/r2/addstatus.jsp', system, api_key, data)
+
+
+def add_batch_status(system, api_key, statuses: List[Dict], cumulative=False, net=False):
+    """Upload multiple statuses to PVOutput.org in a single request.
+
+    See API doc: https://pvoutput.org/help.html#api-addbatchstatus.
+
+    Args:
+        statuses: List of at most 30 statuses. Each status is a dictionary
+            with the date and value keyword arguments of add_status. The date
+            is required.
+
+    Returns:
+        Response from PVOutput.org.
+
+    Raises:
+        HTTPError: When PVOutput.org returns a non-200 status code.
+    """
+    if len(statuses) > 30:
+        raise ValueError("At most 30 statuses can be uploaded in a single request")
+    records = []
+    for status in statuses:
+        fields = list(_format_date(status['date']))
+        fields += [status.get(k) for k in ('energy_gen', 'power_gen', 'energy_con', 'power_con', 'temp', 'voltage')]
+        records.append(','.join('' if v is None else str(v) for v in fields))
+    data = {'data': ';'.join(records)}
+    if cumulative:
+        data['c1'] = '1'
+    if net:
+        data['n'] = '1'
+
+    return _post('http://pvoutput.org/service/r2/addbatchstatus.jsp', system, api_key, data)
+
+
+def add_status_with_backlog(system, api_key, status: Dict, backlog: Deque[Dict]):
+    """Upload status data to PVOutput.org together with the statuses in the backlog.
+
+    When PVOutput.org can't be reached, the status is kept in the backlog
+    and uploaded with the next call.
+
+    Args:
+        status: Dictionary with the date and value keyword arguments of
+            add_status. The date is required.
+        backlog: Statuses that failed to upload before, this should have a
+            maximum length of at most 30. Cleared on success.
+
+    Raises:
+        HTTPError: When PVOutput.org returns a non-200 status code.
+    """
+    backlog.append(status)
+    try:
+        if len(backlog) == 1:
+            add_status(system, api_key, **status)
+        else:
+            # Upload the statuses that failed before together with this one
+            add_batch_status(system, api_key, list(backlog))
+    except HTTPError:
+        raise
+    except OSError as e:
+        # URLError and errors while reading the response, like a reset connection or timeout
+        logging.warning("Could not reach PVOutput.org, will retry with the next upload: %s", e)
+        return
+    backlog.clear()
+
+
+def _format_date(date: datetime) -> Tuple[str, str]:
+    """Returns the date and time strings for PVOutput.org, e.g. ('20230101', '10:05')."""
+    return f'{date.year:04d}{date.month:02d}{date.day:02d}', f'{date.hour:02d}:{date.minute:02d}'
+
+
+def _post(url, system, api_key, data: Dict):
+    """Sends a POST request to the PVOutput.org API."""
     data = urlencode(data).encode('ascii')
-    req = Request('http://pvoutput.org/service/r2/addstatus.jsp', data)
+    req = Request(url, data)
     req.add_header('X-Pvoutput-SystemId', system)
     req.add_header('X-Pvoutput-Apikey', api_key)
     logging.debug("PVOutput.org request: %s", req)
-    return urlopen(req)
+    # Don't let an unresponsive server block the caller indefinitely
+    return urlopen(req, timeout=30)
 
 
 def aggregate_statuses(statuses: List[Dict], dc_voltage=False) -> Optional[Dict]:
@@ -66,12 +142,6 @@ def aggregate_statuses(statuses: List[Dict], dc_voltage=False) -> Optional[Dict]
         Dictionary of keyword arguments for add_status() or None if no inverter
         has operation mode normal.
     """
-
-    def avg(items):
-        """Calculates average."""
-        i = list(items)
-        return sum(i) / len(i)
-
     # Calculate values for each inverter separately
     values = []
     for s in statuses:
@@ -82,10 +152,10 @@ def aggregate_statuses(statuses: List[Dict], dc_voltage=False) -> Optional[Dict]
         # Calculate voltage
         if dc_voltage:
             # Takes average of PV1 and PV2 voltage
-            voltage = avg([s['pv1_voltage'], s['pv2_voltage']])
+            voltage = (s['pv1_voltage'] + s['pv2_voltage']) / 2
         elif 'grid_voltage_r_phase' in s:
             # For three-phase inverters, take average voltage of all three phases
-            voltage = avg([s['grid_voltage_r_phase'], s['grid_voltage_s_phase'], s['grid_voltage_t_phase']])
+            voltage = (s['grid_voltage_r_phase'] + s['grid_voltage_s_phase'] + s['grid_voltage_t_phase']) / 3
         else:
             # For one phase inverter, pick the grid voltage
             voltage = s['grid_voltage']
@@ -100,10 +170,16 @@ def aggregate_statuses(statuses: List[Dict], dc_voltage=False) -> Optional[Dict]
     # Aggregate values of all inverters
     if not values:
         return None
+    if len(values) == 1:
+        # Common case of a single inverter, nothing to aggregate
+        v, = values
+        v['temp'] = round(v['temp'], 1)
+        v['voltage'] = round(v['voltage'], 1)
+        return v
 
     return {
         'energy_gen': sum(v['energy_gen'] for v in values),
         'power_gen': sum(v['power_gen'] for v in values),
-        'temp': round(avg(v['temp'] for v in values), 1),
-        'voltage': round(avg(v['voltage'] for v in values), 1),
+        'temp': round(sum(v['temp'] for v in values) / len(values), 1),
+        'voltage': round(sum(v['voltage'] for v in values) / len(values), 1),
     }
@@ -1,6 +1,42 @@
 """Defines all types of status values that may be returned by the inverter."""
-from collections import OrderedDict
+import struct
 from decimal import Decimal
+from functools import lru_cache
+from typing import Tuple, Optional, Callable, Any, Dict, List
+
+
+@lru_cache(maxsize=8)
+def _format_index(status_format: bytes) -> Tuple[int, ...]:
+    """Returns a table that maps each type ID to its position in the status format.
+
+    Type IDs are single bytes, so the table has 256 entries. Type IDs that do
+    not appear in the format map to -1. The table is cached because the format
+    does not change between status messages.
+    """
+    index = [-1] * 256
+    # Iterate backwards so that the first occurrence wins, like bytes.find
+    for i in range(len(status_format) - 1, -1, -1):
+        index[status_format[i]] = i
+    return tuple(index)
+
+
+# Struct formats for integers of 1 or 2 consecutive type IDs, keyed by (number of type IDs, signed)
+_INT_STRUCTS = {
+    (1, False): struct.Struct('>H'),
+    (1, True): struct.Struct('>h'),
+    (2, False): struct.Struct('>I'),
+    (2, True): struct.Struct('>i'),
+}
+
+
+def _bytes_getter(indices: List[int]) -> Callable[[bytes], bytes]:
+    """Returns a function that gets the bytes at the given format positions from a status payload."""
+    slices = [slice(i * 2, i * 2 + 2) for i in indices]
+    if len(slices) == 1:
+        # Most status values have a single type ID, no need to join
+        s, = slices
+        return lambda payload: payload[s]
+    return lambda payload: b''.join([payload[s] for s in slices])
 
 
 class StatusType:
@@ -21,6 +57,26 @@ class StatusType:
         Returns:
             The value for this status type or None if the value is not present.
         """
+        decode = self.bind(status_format)
+        if decode is None:
+            return None
+        return decode(status_payload)
+
+    def bind(self, status_format) -> Optional[Callable[[bytes], Any]]:
+        """Returns a function that gets the value from a status payload.
+
+        The positions of the type IDs in the format are looked up once, so
+        this is faster than get_value when many payloads have the same format.
+
+        Args:
+            status_format: The status format byte-string as provided by the
+                inverter.
+
+        Returns:
+            A function that takes the status payload and returns the value for
+            this status type, or None if the value is not present in the
+            format.
+        """
         raise NotImplementedError("Abstract method")
 
 
@@ -37,13 +93,20 @@ class BytesStatusType(StatusType):
         """
         self.type_ids = type_ids
 
-    def get_value(self, status_format, status_payload):
+    def bind(self, status_format):
         """See base class."""
-        indices = [status_format.find(type_id) for type_id in self.type_ids]
+        indices = self._indices(status_format)
+        if indices is None:
+            return None
+        return _bytes_getter(indices)
+
+    def _indices(self, status_format) -> Optional[List[int]]:
+        """Returns the positions of the type IDs in the format, or None if one of them is missing."""
+        index = _format_index(status_format)
+        indices = [index[type_id] for type_id in self.type_ids]
         if -1 in indices:
             return None
-        values = [status_payload[i * 2:i * 2 + 2] for i in indices]
-        return b''.join(values)
+        return indices
 
 
 class IntStatusType(BytesStatusType):
@@ -61,12 +124,28 @@ class IntStatusType(BytesStatusType):
         super().__init__(*type_ids)
         self.signed = signed
 
-    def get_value(self, status_format, status_payload):
+    def bind(self, status_format):
         """See base class."""
-        sequence = super().get_value(status_format, status_payload)
-        if sequence is None:
+        indices = self._indices(status_format)
+        if indices is None:
             return None
-        return int.from_bytes(sequence, byteorder='big', signed=self.signed)
+        get_bytes = _bytes_getter(indices)
+        signed = self.signed
+        int_struct = _INT_STRUCTS.get((len(indices), signed))
+        if int_struct is None or indices != list(range(indices[0], indices[0] + len(indices))):
+            return lambda payload: int.from_bytes(get_bytes(payload), byteorder='big', signed=signed)
+        # The values are consecutive in the payload, unpack them in one go
+        unpack_from = int_struct.unpack_from
+        offset = indices[0] * 2
+
+        def decode(payload):
+            try:
+                return unpack_from(payload, offset)[0]
+            except struct.error:
+                # Truncated payload, decode what is there like int.from_bytes does
+                return int.from_bytes(get_bytes(payload), byteorder='big', signed=signed)
+
+        return decode
 
 
 class DecimalStatusType(IntStatusType):
@@ -84,12 +163,20 @@ class DecimalStatusType(IntStatusType):
         super().__init__(*type_ids, signed=signed)
         self.scale = scale
 
-    def get_value(self, status_format, status_payload):
+    def bind(self, status_format):
         """See base class."""
-        int_val = super().get_value(status_format, status_payload)
-        if int_val is None:
+        get_int = super().bind(status_format)
+        if get_int is None:
             return None
-        return Decimal(int_val).scaleb(self.scale)
+        if self.scale == 0:
+            return lambda payload: Decimal(get_int(payload))
+        # Multiplying by 1E<scale> gives the same result as scaleb, but is faster
+        factor = Decimal(1).scaleb(self.scale)
+        return lambda payload: Decimal(get_int(payload)) * factor
+
+
+# Operation mode names, indexed by the value returned by the inverter
+_OPERATION_MODES = ('Wait', 'Normal', 'Fault', 'Permanent fault', 'Check', 'PV power off')
 
 
 class OperationModeStatusType(IntStatusType):
@@ -103,15 +190,16 @@ class OperationModeStatusType(IntStatusType):
         """Constructor."""
         super().__init__(0x0c)
 
-    def get_value(self, status_format, status_payload):
+    def bind(self, status_format):
         """See base class."""
-        int_val = super().get_value(status_format, status_payload)
-        operating_modes = {0: 'Wait', 1: 'Normal', 2: 'Fault', 3: 'Permanent fault', 4: 'Check', 5: 'PV power off'}
-        return operating_modes[int_val]
+        get_int = super().bind(status_format)
+        if get_int is None:
+            return None
+        return lambda payload: _OPERATION_MODES[get_int(payload)]
 
 
 class OneOfStatusType(StatusType):
-    """Returns the value of the first not-None status type value.
+    """Returns the value of the first status type that is present.
 
     Can be used for the case when there are multiple type IDs that refer to the
     same status type and are mutually exclusive.
@@ -125,12 +213,12 @@ class OneOfStatusType(StatusType):
         """
         self.status_types = status_types
 
-    def get_value(self, status_format, status_payload):
+    def bind(self, status_format):
         """See base class."""
         for status_type in self.status_types:
-            val = status_type.get_value(status_format, status_payload)
-            if val is not None:
-                return val
+            decode = status_type.bind(status_format)
+            if decode is not None:
+                return decode
         return None
 
 
@@ -151,15 +239,15 @@ class IfPresentStatusType(BytesStatusType):
         self.presence = presence
         self.status_type = status_type
 
-    def get_value(self, status_format, status_payload):
+    def bind(self, status_format):
         """See base class."""
-        actual_presence = super().get_value(status_format, status_payload) is not None
+        actual_presence = super().bind(status_format) is not None
         if self.presence == actual_presence:
-            return self.status_type.get_value(status_format, status_payload)
+            return self.status_type.bind(status_format)
         return None
 
 
-status_types = OrderedDict(
+status_types = dict(
     operation_mode=OperationModeStatusType(),
     total_operation_time=IntStatusType(0x09, 0x0a),
     pv1_input_power=DecimalStatusType(0x27),
@@ -186,3 +274,29 @@ status_types = OrderedDict(
     internal_temperature=DecimalStatusType(0x00, signed=True, scale=-1),
     heatsink_temperature=DecimalStatusType(0x2f, signed=True, scale=-1),
 )
+
+
+@lru_cache(maxsize=8)
+def _status_decoders(status_format: bytes) -> Tuple[Tuple[str, Callable[[bytes], Any]], ...]:
+    """Returns name and decode function for each status type that is present in the format."""
+    decoders = []
+    for name, status_type in status_types.items():
+        decode = status_type.bind(status_format)
+        if decode is not None:
+            decoders.append((name, decode))
+    return tuple(decoders)
+
+
+def decode_status(status_format: bytes, status_payload: bytes) -> Dict[str, Any]:
+    """Returns the values of all status types that are present in the status format.
+
+    The positions of the values in the payload are only looked up for the
+    first payload with a given status format.
+
+    Args:
+        status_format: The status format byte-string as provided by the
+            inverter.
+        status_payload: The status data byte-string as provided by the
+            inverter.
+    """
+    return {name: decode(status_payload) for name, decode in _status_decoders(status_format)}
@@ -1,13 +1,13 @@
 """Test cases for inverter.py."""
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from queue import Queue
-from socket import socketpair, create_connection
-from threading import Thread
-from time import sleep
+from socket import socketpair, create_connection, IPPROTO_TCP, TCP_NODELAY
+from time import monotonic, sleep
 from unittest import TestCase
+from unittest.mock import patch
 
 from samil.inverter import calculate_checksum, construct_message, Inverter, InverterEOFError, InverterFinder, \
-    InverterNotFoundError, read_message, KeepAliveInverter
+    InverterNotFoundError, read_message, KeepAliveInverter, decode_string
 
 
 class MessageTestCase(TestCase):
@@ -19,6 +19,11 @@ class MessageTestCase(TestCase):
         checksum = bytes.fromhex("01 ee")
         self.assertEqual(checksum, calculate_checksum(message))
 
+    def test_checksum_overflow(self):
+        """Tests that the checksum wraps around for long messages."""
+        message = b"\xff" * 300  # Sum is 0x12ad4
+        self.assertEqual(b"\x2a\xd4", calculate_checksum(message))
+
     def test_construct(self):
         """Tests message construction."""
         identifier = b'\x06\x01\x02'
@@ -33,10 +38,32 @@ class MessageTestCase(TestCase):
         self.assertEqual(b"\x06\x01\x02", ident)
         self.assertEqual(b"\x10\x10", payload)
 
+    def test_read_truncated(self):
+        """Tests that a message which ends prematurely raises EOF error."""
+        f = BytesIO(bytes.fromhex("55 aa 06 01 02 00 02 10"))
+        with self.assertRaises(InverterEOFError):
+            read_message(f)
+
+    def test_read_invalid_checksum(self):
+        """Tests that a message with a wrong checksum raises ValueError."""
+        f = BytesIO(bytes.fromhex("55 aa 06 01 02 00 02 10 10 01 2b"))
+        with self.assertRaises(ValueError):
+            read_message(f)
+
 
 message = b"\x55\xaa\x00\x01\x02\x00\x00\x01\x02"  # Sample inverter message
 
 
+class DecodeStringTestCase(TestCase):
+    def test_null_terminated(self):
+        self.assertEqual("SR2.8K", decode_string(b"SR2.8K  \x00\x00\x00"))
+
+    def test_bytearray(self):
+        """Tests that unhashable byte sequences can be decoded."""
+        self.assertEqual("SAMIL", decode_string(bytearray(b"SAMIL\x00")))
+        self.assertEqual("SAMIL", decode_string(memoryview(b"SAMIL\x00")))
+
+
 class InverterConnectionTestCase(TestCase):
     """Test low-level send/receive inverter messages over a socket connection.
 
@@ -89,20 +116,18 @@ class InverterConnectionTestCase(TestCase):
 
     def test_chopped_message(self):
         """Messages might arrive chopped for TCP sockets."""
-        queue = Queue()
         # Receive the message in a separate thread, because it blocks
-        thread = Thread(target=lambda q: q.put(self.inverter.receive()), args=(queue,))
-        thread.start()
-        self.sock.send(message[0:1])  # Send some message parts
-        sleep(0.01)
-        self.sock.send(message[1:3])
-        sleep(0.01)
-        self.sock.send(message[3:7])
-        sleep(0.01)
-        self.sock.send(message[7:])
-        thread.join()
-        # Check result
-        ident, payload = queue.get(timeout=1.0)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self.inverter.receive)
+            self.sock.send(message[0:1])  # Send some message parts
+            sleep(0.01)
+            self.sock.send(message[1:3])
+            sleep(0.01)
+            self.sock.send(message[3:7])
+            sleep(0.01)
+            self.sock.send(message[7:])
+            # Check result
+            ident, payload = future.result(timeout=1.0)
         self.assertEqual(b"\x00\x01\x02", ident)
         self.assertEqual(b"", payload)
 
@@ -112,6 +137,10 @@ class InverterConnectionTestCase(TestCase):
         received_message = self.sock.recv(4096)
         self.assertEqual(message, received_message)
 
+    def test_send_payload(self):
+        self.inverter.send(b"\x00\x01\x02", b"\x01")
+        self.assertEqual(construct_message(b"\x00\x01\x02", b"\x01"), self.sock.recv(4096))
+
     def test_disconnect_multiple(self):
         """Tests if disconnect can be called multiple times."""
         self.inverter.disconnect()
@@ -121,9 +150,48 @@ class InverterConnectionTestCase(TestCase):
         """Tests if disconnect can be called on a closed socket."""
         self.sock.close()
         self.inverter.sock.close()
-        self.inverter.sock_file.close()
         self.inverter.disconnect()  # Should not raise exception
 
+    def test_status_format_shared(self):
+        """Tests if the status format of another inverter with the same model is reused."""
+        key = ('SAMIL', 'V1.30', 'SR2.8K')
+        self.inverter._model_key = key
+        Inverter._format_cache[key] = b"\x0c"
+        try:
+            self.sock.send(construct_message(b"\x01\x82\x00", b"\x00\x01"))
+            self.assertEqual({'operation_mode': 'Normal'}, self.inverter.status())
+            # Only the status request should have been sent, not the format request
+            self.assertEqual(construct_message(b"\x01\x02\x02", b""), self.sock.recv(4096))
+        finally:
+            del Inverter._format_cache[key]
+
+    def test_status_format_shared_mismatch(self):
+        """Tests if a shared status format that does not fit the payload is replaced by the own format."""
+        key = ('SAMIL', 'V1.30', 'SR2.8K')
+        self.inverter._model_key = key
+        Inverter._format_cache[key] = b"\x0c\x01"
+        try:
+            self.sock.send(construct_message(b"\x01\x82\x00", b"\x00\x01"))
+            self.sock.send(construct_message(b"\x01\x80\x00", b"\x0c"))
+            self.assertEqual({'operation_mode': 'Normal'}, self.inverter.status())
+            # The status request is followed by a request for the own format
+            self.assertEqual(construct_message(b"\x01\x02\x02", b"") + construct_message(b"\x01\x00\x02", b""),
+                             self.sock.recv(4096))
+            self.assertNotIn(key, Inverter._format_cache)
+            self.assertEqual(b"\x0c", self.inverter._status_format)
+        finally:
+            Inverter._format_cache.pop(key, None)
+
+    def test_status_format_own_mismatch(self):
+        """Tests if an own status format that does not fit the payload is kept."""
+        self.inverter._status_format = b"\x0c"
+        self.sock.send(construct_message(b"\x01\x82\x00", b"\x00\x01\x00\x00"))
+        with self.assertLogs('samil.inverter', 'WARNING'):
+            self.assertEqual({'operation_mode': 'Normal'}, self.inverter.status())
+        # Only the status request should have been sent, not the format request
+        self.assertEqual(construct_message(b"\x01\x02\x02", b""), self.sock.recv(4096))
+        self.assertEqual(b"\x0c", self.inverter._status_format)
+
 
 class InverterFinderTestCase(TestCase):
     def test_inverter_not_found(self):
@@ -132,7 +200,8 @@ class InverterFinderTestCase(TestCase):
             with self.assertRaises(InverterNotFoundError):
                 finder.find_inverter(advertisements=2, interval=0.01)
 
-    def test_new_connection(self):
+    @patch('samil.inverter.sleep')  # Skip the wait after an inverter is found
+    def test_new_connection(self, sleep_mock):
         """Tests if a new connection is returned."""
         with InverterFinder() as finder:
             sock1 = create_connection(('127.0.0.1', 1200))
@@ -143,6 +212,29 @@ class InverterFinderTestCase(TestCase):
         sock1.close()
         sock2.close()
 
+    @patch('samil.inverter.sleep')  # Skip the wait after an inverter is found
+    def test_inverter_no_delay(self, sleep_mock):
+        """Tests if Nagle's algorithm is disabled for inverter connections."""
+        with InverterFinder() as finder:
+            sock = create_connection(('127.0.0.1', 1200))
+            inverter = Inverter(*finder.find_inverter())
+        self.assertTrue(inverter.sock.getsockopt(IPPROTO_TCP, TCP_NODELAY))
+        inverter.disconnect()
+        sock.close()
+
+    @patch('samil.inverter.sleep')  # Skip the wait after an inverter is found
+    def test_multiple_connections(self, sleep_mock):
+        """Tests if multiple connections are returned by one search."""
+        with InverterFinder() as finder:
+            socks = [create_connection(('127.0.0.1', 1200)) for i in range(2)]
+            found = finder.find_inverters(2)
+        self.assertEqual(2, len(found))
+        sleep_mock.assert_called_once()  # Only one wait for all inverters
+        for sock, addr in found:
+            sock.close()
+        for sock in socks:
+            sock.close()
+
     def test_open_with_retries_exception(self):
         """Tests if OSError is thrown after all retries have failed."""
         port_blocker = InverterFinder()
@@ -159,25 +251,23 @@ class InverterFinderTestCase(TestCase):
         port_blocker.open()
 
         # Try binding port using retry function in separate thread
-        def try_bind(q: Queue):
+        def try_bind():
             finder = InverterFinder()
             finder.open_with_retries(retries=10, period=0.01)
             finder.close()
             # If bind failed, an exception should've been thrown by now
             # I assume the bind has succeeded here
-            q.put(True)
+            return True
 
-        queue = Queue()
-        thread = Thread(target=try_bind, args=(queue,))
-        thread.start()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(try_bind)
 
-        # Unbind port
-        sleep(0.01)
-        port_blocker.close()
+            # Unbind port
+            sleep(0.01)
+            port_blocker.close()
 
-        # Check if bind succeeded
-        thread.join()
-        succeeded = queue.get(timeout=1.0)
+            # Check if bind succeeded
+            succeeded = future.result(timeout=1.0)
         self.assertTrue(succeeded)
 
 
@@ -211,17 +301,39 @@ class KeepAliveInverterTestCase(TestCase):
         self.sock.send(bytes.fromhex("55 aa 01 02 02 00 00 01 04"))
 
     def test_keep_alive_cancelled(self):
-        """Tests if keep-alive messages are cancelled when other messages are sent."""
-        sleep(0.005)  # Wait before a keep-alive message will be sent
+        """Tests if keep-alive messages are postponed when other messages are sent."""
+        sent = monotonic()
         self.inverter.send(b"\x01\x02\x03", b"")  # Send something arbitrary
         self.sock.recv(4096)  # Retrieve the sent message
-        sleep(0.008)  # Wait until just before the next keep-alive is supposed to happen
-        # Check that no message was sent
-        self.sock.setblocking(False)
-        with self.assertRaises(BlockingIOError):
-            self.sock.recv(4096)
+        # The next keep-alive message should only arrive a full period after the sent message
+        msg = self.sock.recv(4096)
+        self.assertGreaterEqual(monotonic() - sent, 0.01)
+        self.assertTrue(msg.startswith(b"\x55\xaa"))
+        # Send some arbitrary response
+        self.sock.send(bytes.fromhex("55 aa 01 02 02 00 00 01 04"))
+
+    def test_keep_alive_thread_reused(self):
+        """Tests that sending a message does not replace the keep-alive thread."""
+        thread = self.inverter._ka_thread
+        self.inverter.send(b"\x01\x02\x03", b"")
+        self.sock.recv(4096)
+        self.assertIs(thread, self.inverter._ka_thread)
+
+    def test_keep_alive_resumed(self):
+        """Tests if keep-alive messages continue after one was not answered."""
+        # Shorten the receive timeout so that the unanswered keep-alive fails quickly
+        self.inverter.stop_keep_alive()
+        self.inverter.sock.settimeout(0.05)
+        self.inverter.start_keep_alive()
+        self.sock.recv(4096)  # Leave the first keep-alive unanswered
+        with self.assertLogs('samil.inverter', 'WARNING'):
+            msg = self.sock.recv(4096)
+        self.assertTrue(msg.startswith(b"\x55\xaa"))
+        self.sock.send(bytes.fromhex("55 aa 01 02 02 00 00 01 04"))
+        self.assertTrue(self.inverter._ka_thread.is_alive())
 
     def test_disconnect(self):
         """Tests if the keep-alive messages will stop cleanly."""
+        thread = self.inverter._ka_thread
         self.inverter.disconnect()
-        sleep(0.02)
+        self.assertFalse(thread.is_alive())
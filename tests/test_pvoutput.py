@@ -1,21 +1,28 @@
+from datetime import datetime
+from collections import deque
 from decimal import Decimal
 from unittest import TestCase
+from unittest.mock import patch
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs
 
-from samil.pvoutput import aggregate_statuses
+from samil.pvoutput import aggregate_statuses, add_batch_status, add_status_with_backlog
 
 
 class AggregateStatusesTestCase(TestCase):
 
+    base_status = {
+        'pv1_voltage': Decimal('442.8'),
+        'pv2_voltage': Decimal('460.9'),
+        'grid_voltage': Decimal('228.5'),
+        'internal_temperature': Decimal('21.1'),
+        'output_power': Decimal('170'),
+        'energy_today': Decimal('5.67'),
+        'operation_mode': "Normal",
+    }
+
     def setUp(self) -> None:
-        self.status = {
-            'pv1_voltage': Decimal('442.8'),
-            'pv2_voltage': Decimal('460.9'),
-            'grid_voltage': Decimal('228.5'),
-            'internal_temperature': Decimal('21.1'),
-            'output_power': Decimal('170'),
-            'energy_today': Decimal('5.67'),
-            'operation_mode': "Normal",
-        }
+        self.status = dict(self.base_status)
 
     def test_non_normal_operation_mode(self):
         self.status['operation_mode'] = "Not normal"
@@ -66,3 +73,68 @@ class AggregateStatusesTestCase(TestCase):
             'temp': Decimal('21.1'),
             'voltage': Decimal('451.8'),
         }, r)
+
+
+class AddBatchStatusTestCase(TestCase):
+
+    @patch('samil.pvoutput.urlopen')
+    def test_request(self, urlopen):
+        add_batch_status('1234', 'key', [
+            {'date': datetime(2023, 1, 1, 10, 0), 'energy_gen': 5670, 'power_gen': 170},
+            {'date': datetime(2023, 1, 1, 10, 5), 'energy_gen': 5680, 'power_gen': 120, 'temp': Decimal('21.1')},
+        ])
+        req = urlopen.call_args[0][0]
+        self.assertEqual('http://pvoutput.org/service/r2/addbatchstatus.jsp', req.full_url)
+        self.assertEqual('1234', req.get_header('X-pvoutput-systemid'))
+        self.assertEqual({'data': ['20230101,10:00,5670,170,,,,;20230101,10:05,5680,120,,,21.1,']},
+                         parse_qs(req.data.decode('ascii')))
+
+    def test_too_many(self):
+        with self.assertRaises(ValueError):
+            add_batch_status('1234', 'key', [{'date': datetime(2023, 1, 1)}] * 31)
+
+
+class AddStatusWithBacklogTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.backlog = deque(maxlen=30)
+        self.status1 = {'date': datetime(2023, 1, 1, 10, 0), 'energy_gen': 5670, 'power_gen': 170}
+        self.status2 = {'date': datetime(2023, 1, 1, 10, 5), 'energy_gen': 5680, 'power_gen': 120}
+
+    @patch('samil.pvoutput.urlopen')
+    def test_single(self, urlopen):
+        add_status_with_backlog('1234', 'key', self.status1, self.backlog)
+        req = urlopen.call_args[0][0]
+        self.assertEqual('http://pvoutput.org/service/r2/addstatus.jsp', req.full_url)
+        self.assertEqual(0, len(self.backlog))
+
+    @patch('samil.pvoutput.urlopen')
+    def test_unreachable(self, urlopen):
+        urlopen.side_effect = URLError('unreachable')
+        with self.assertLogs(level='WARNING'):
+            add_status_with_backlog('1234', 'key', self.status1, self.backlog)
+        self.assertEqual([self.status1], list(self.backlog))
+
+        # The next upload sends both statuses in one batch request
+        urlopen.side_effect = None
+        urlopen.reset_mock()
+        add_status_with_backlog('1234', 'key', self.status2, self.backlog)
+        urlopen.assert_called_once()
+        req = urlopen.call_args[0][0]
+        self.assertEqual('http://pvoutput.org/service/r2/addbatchstatus.jsp', req.full_url)
+        self.assertEqual({'data': ['20230101,10:00,5670,170,,,,;20230101,10:05,5680,120,,,,']},
+                         parse_qs(req.data.decode('ascii')))
+        self.assertEqual(0, len(self.backlog))
+
+    @patch('samil.pvoutput.urlopen')
+    def test_connection_reset(self, urlopen):
+        urlopen.side_effect = ConnectionResetError()
+        with self.assertLogs(level='WARNING'):
+            add_status_with_backlog('1234', 'key', self.status1, self.backlog)
+        self.assertEqual([self.status1], list(self.backlog))
+
+    @patch('samil.pvoutput.urlopen')
+    def test_http_error(self, urlopen):
+        urlopen.side_effect = HTTPError('http://pvoutput.org', 400, 'Bad request', {}, None)
+        with self.assertRaises(HTTPError):
+            add_status_with_backlog('1234', 'key', self.status1, self.backlog)
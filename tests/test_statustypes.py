@@ -2,15 +2,19 @@ from decimal import Decimal
 from unittest import TestCase
 
 from samil.inverter import decode_string
-from samil.statustypes import DecimalStatusType, \
-    OperationModeStatusType, OneOfStatusType, BytesStatusType, IfPresentStatusType
+from samil.statustypes import DecimalStatusType, IntStatusType, \
+    OperationModeStatusType, OneOfStatusType, BytesStatusType, IfPresentStatusType, decode_status
+
+# Sample status format and message of a SolarRiver inverter, shared by the test cases below
+status_format = bytes.fromhex("00 01 02 04 05 09 0a 0c 11 17 18 1b 1c 1d 1e 1f 20 21 22 27 28 31 32 33 34 35 36")
+status_message = bytes.fromhex("01 77 0b ac 0b e1 00 15 00 14 00 00 28 40 00 01 01 da 00 00 00 00 00 00 00 " +
+                               "00 00 00 00 00 00 00 00 00 00 00 00 00 02 8c 02 76 00 38 09 1b 13 86 04 fb " +
+                               "00 01 b1 cc")
 
 
 class BytesStatusTypeTestCase(TestCase):
-    status_format = bytes.fromhex("00 01 02 04 05 09 0a 0c 11 17 18 1b 1c 1d 1e 1f 20 21 22 27 28 31 32 33 34 35 36")
-    status_message = bytes.fromhex("01 77 0b ac 0b e1 00 15 00 14 00 00 28 40 00 01 01 da 00 00 00 00 00 00 00 " +
-                                   "00 00 00 00 00 00 00 00 00 00 00 00 00 02 8c 02 76 00 38 09 1b 13 86 04 fb " +
-                                   "00 01 b1 cc")
+    status_format = status_format
+    status_message = status_message
 
     def test_none(self):
         t = BytesStatusType(0x03, 0x04)
@@ -24,22 +28,64 @@ class BytesStatusTypeTestCase(TestCase):
         t = BytesStatusType(0x02, 0x01)
         self.assertEqual(b'\x0b\xe1\x0b\xac', t.get_value(self.status_format, self.status_message))
 
+    def test_bind(self):
+        self.assertIsNone(BytesStatusType(0x03).bind(self.status_format))
+        decode = BytesStatusType(0x01).bind(self.status_format)
+        self.assertEqual(b'\x0b\xac', decode(self.status_message))
+
+
+class IntStatusTypeTestCase(TestCase):
+    status_format = bytes.fromhex("00 01 02 04")
+    status_message = bytes.fromhex("01 77 0b ac ff e1 00 15")
+
+    def test_two(self):
+        self.assertEqual(0x0bacffe1, IntStatusType(0x01, 0x02).get_value(self.status_format, self.status_message))
+
+    def test_two_reverse(self):
+        self.assertEqual(0xffe10bac, IntStatusType(0x02, 0x01).get_value(self.status_format, self.status_message))
+
+    def test_signed(self):
+        self.assertEqual(-31, IntStatusType(0x02, signed=True).get_value(self.status_format, self.status_message))
+        self.assertEqual(0xffe1, IntStatusType(0x02).get_value(self.status_format, self.status_message))
+
+    def test_truncated(self):
+        self.assertEqual(0x0b, IntStatusType(0x01).get_value(self.status_format, self.status_message[:3]))
+        self.assertEqual(0, IntStatusType(0x04).get_value(self.status_format, self.status_message[:4]))
+
 
 class DecimalStatusTypeTestCase(TestCase):
-    status_format = bytes.fromhex("00 01 02 04 05 09 0a 0c 11 17 18 1b 1c 1d 1e 1f 20 21 22 27 28 31 32 33 34 35 36")
-    status_message = bytes.fromhex("01 77 0b ac 0b e1 00 15 00 14 00 00 28 40 00 01 01 da 00 00 00 00 00 00 00 " +
-                                   "00 00 00 00 00 00 00 00 00 00 00 00 00 02 8c 02 76 00 38 09 1b 13 86 04 fb " +
-                                   "00 01 b1 cc")
+    status_format = status_format
+    status_message = status_message
 
     def test_get_value(self):
         status_type = DecimalStatusType(0x35, 0x36, scale=-1)
         self.assertEqual(Decimal('11105.2'), status_type.get_value(self.status_format, self.status_message))
 
+    def test_get_value_scale(self):
+        def value(status_type):
+            return str(status_type.get_value(self.status_format, self.status_message))
+
+        self.assertEqual('233.1', value(DecimalStatusType(0x32, scale=-1)))
+        self.assertEqual('652', value(DecimalStatusType(0x27)))
+        self.assertEqual('6.52E+3', value(DecimalStatusType(0x27, scale=1)))
+
     def test_get_value_none(self):
         status_type = DecimalStatusType(0x37)
         self.assertIsNone(status_type.get_value(self.status_format, self.status_message))
 
 
+class DecodeStatusTestCase(TestCase):
+    status_format = status_format
+    status_message = status_message
+
+    def test_decode_status(self):
+        status = decode_status(self.status_format, self.status_message)
+        self.assertEqual('Normal', status['operation_mode'])
+        self.assertEqual(Decimal('11105.2'), status['energy_total'])
+        self.assertEqual(Decimal('233.1'), status['grid_voltage'])
+        self.assertNotIn('grid_voltage_r_phase', status)
+
+
 class StringDecodeTestCase(TestCase):
     def test_samil_string(self):
         expect = "V1"
@@ -80,18 +126,13 @@ class IfPresentStatusTypeTestCase(TestCase):
         status_payload = bytes.fromhex("12 34")
         status_type = BytesStatusType(0x00)
 
-        # If present and actually present
-        t = IfPresentStatusType(0x00, True, status_type)
-        self.assertEqual(b'\x12\x34', t.get_value(status_format, status_payload))
-
-        # If present while not actually present
-        t = IfPresentStatusType(0x01, True, status_type)
-        self.assertIsNone(t.get_value(status_format, status_payload))
-
-        # If not present while actually present
-        t = IfPresentStatusType(0x00, False, status_type)
-        self.assertIsNone(t.get_value(status_format, status_payload))
-
-        # If not present and actually not present
-        t = IfPresentStatusType(0x01, False, status_type)
-        self.assertEqual(b'\x12\x34', t.get_value(status_format, status_payload))
+        cases = (
+            (0x00, True, b'\x12\x34'),  # If present and actually present
+            (0x01, True, None),  # If present while not actually present
+            (0x00, False, None),  # If not present while actually present
+            (0x01, False, b'\x12\x34'),  # If not present and actually not present
+        )
+        for status_id, if_present, expect in cases:
+            with self.subTest(status_id=status_id, if_present=if_present):
+                t = IfPresentStatusType(status_id, if_present, status_type)
+                self.assertEqual(expect, t.get_value(status_format, status_payload))